@@ -7,13 +7,21 @@ import json
 import time
 import random
 import os
+import signal
 import logging
+import queue
+import socket
 import threading
 from datetime import datetime
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from socketserver import ThreadingMixIn
 import paho.mqtt.client as mqtt
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -21,16 +29,106 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    """Thread-safe HTTP Server"""
-    daemon_threads = True
+def dump_json(obj, indent=False):
+    """Serialize obj to JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode()
+
+# Prometheus exposition body; only the four values are formatted per scrape
+METRICS_TEMPLATE = b"""# HELP smarthome_publisher_mqtt_connected MQTT connection status
+# TYPE smarthome_publisher_mqtt_connected gauge
+smarthome_publisher_mqtt_connected %d
+
+# HELP smarthome_publisher_publish_total Total number of publishes
+# TYPE smarthome_publisher_publish_total counter
+smarthome_publisher_publish_total %d
+
+# HELP smarthome_publisher_errors_total Total number of errors
+# TYPE smarthome_publisher_errors_total counter
+smarthome_publisher_errors_total %d
+
+# HELP smarthome_publisher_sensors_count Number of configured sensors
+# TYPE smarthome_publisher_sensors_count gauge
+smarthome_publisher_sensors_count %d
+"""
+
+# How long a rendered /health or /metrics response is reused, to absorb probe and scrape storms
+RESPONSE_CACHE_TTL = 1.0
+
+# Seconds between publish cycles
+PUBLISH_INTERVAL = 30
+
+# Range of simulated battery levels, in percent
+BATTERY_LEVELS = range(70, 101)
+
+# Aggregated topic carrying every room in a single payload, keyed by room name
+BATCH_TOPIC = "smarthome/sensors/all"
+
+# At-least-once sequence-number heartbeat, lets consumers detect gaps in QoS 0 telemetry
+HEARTBEAT_TOPIC = "smarthome/heartbeat"
+
+class StatCounter:
+    """Stats counter incremented only from the main loop thread and read from HTTP threads"""
+    
+    def __init__(self):
+        self._count = 0
+    
+    def inc(self):
+        """Increment by one; must only be called from the main loop thread"""
+        self._count += 1
+    
+    def value(self):
+        """Return the current count; reading an int attribute is atomic, so any thread may call this"""
+        return self._count
+
+class ThreadPoolMixIn(ThreadingMixIn):
+    """Serve requests from a fixed pool of reusable daemon threads instead of one thread per request"""
+    
+    def __init__(self, server_address, RequestHandlerClass, pool_size=8):
+        super().__init__(server_address, RequestHandlerClass)
+        self._requests = queue.Queue()
+        self._pool_size = max(1, pool_size)
+        for _ in range(self._pool_size):
+            threading.Thread(target=self.process_request_worker, daemon=True).start()
+    
+    def process_request_worker(self):
+        """Worker loop: handle queued requests until server_close() sends the None sentinel"""
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            self.process_request_thread(request, client_address)
+    
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+    
+    def server_close(self):
+        """Close the listening socket and stop every worker once the requests already queued are served"""
+        super().server_close()
+        # Not joined: a worker may be waiting out a keep-alive connection's timeout, and the
+        # sentinel alone guarantees it exits afterwards
+        for _ in range(self._pool_size):
+            self._requests.put(None)
+
+class ThreadedHTTPServer(ThreadPoolMixIn, HTTPServer):
+    """HTTP server that handles requests on a fixed pool of worker threads"""
 
 class HealthCheckHandler(BaseHTTPRequestHandler):
     """HTTP request handler for health checks"""
     
-    def __init__(self, sensor_simulator, *args, **kwargs):
-        self.sensor_simulator = sensor_simulator
-        super().__init__(*args, **kwargs)
+    # Keep connections open between scrapes; every response carries Content-Length
+    protocol_version = 'HTTP/1.1'
+    # Close idle keep-alive connections so they cannot pin the worker pool
+    timeout = 20
+    
+    # Bound per server by SensorSimulator.start_health_server, along with a response cache of
+    # path -> (expiry on the monotonic clock, status code, content type, body) and its lock, so
+    # servers for different simulators never serve each other's responses
+    sensor_simulator = None
+    _response_cache = None
+    _cache_lock = None
     
     def do_GET(self):
         """Handle GET requests"""
@@ -43,26 +141,38 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
         else:
             self.send_error(404, 'Not Found')
     
+    def send_body(self, code, content_type, body):
+        """Send a complete response; Content-Length lets the client reuse the connection"""
+        self.send_response(code)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_cached(self, render):
+        """Send the response for this path, calling render() at most once per RESPONSE_CACHE_TTL"""
+        now = time.monotonic()
+        with self._cache_lock:
+            entry = self._response_cache.get(self.path)
+            if entry is None or now >= entry[0]:
+                entry = (now + RESPONSE_CACHE_TTL,) + render()
+                self._response_cache[self.path] = entry
+        self.send_body(*entry[1:])
+    
+    def render_health_check(self):
+        """Return (status code, content type, body) for the basic health check"""
+        # Check if MQTT client is connected
+        if self.sensor_simulator.is_connected():
+            return 200, 'text/plain', b'OK'
+        return 503, 'text/plain', b'MQTT_DISCONNECTED'
+    
     def handle_health_check(self):
         """Handle basic health check endpoint"""
         try:
-            # Check if MQTT client is connected
-            if self.sensor_simulator.client.is_connected():
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(b'OK')
-            else:
-                self.send_response(503)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(b'MQTT_DISCONNECTED')
+            self.send_cached(self.render_health_check)
         except Exception as e:
             logger.error(f"Health check error: {e}")
-            self.send_response(500)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(f'ERROR: {str(e)}'.encode())
+            self.send_body(500, 'text/plain', f'ERROR: {str(e)}'.encode())
     
     def handle_status_check(self):
         """Handle detailed status endpoint"""
@@ -71,58 +181,39 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
                 'service': 'smart-home-publisher',
                 'version': '1.0.0',
                 'timestamp': datetime.utcnow().isoformat() + 'Z',
-                'mqtt_connected': self.sensor_simulator.client.is_connected(),
+                'mqtt_connected': self.sensor_simulator.is_connected(),
                 'mqtt_broker': f"{self.sensor_simulator.mqtt_broker}:{self.sensor_simulator.mqtt_port}",
                 'sensors_count': len(self.sensor_simulator.sensors),
-                'last_publish': self.sensor_simulator.last_publish_time,
+                'last_publish': self.sensor_simulator.format_last_publish_time(),
                 'publish_count': self.sensor_simulator.publish_count,
                 'error_count': self.sensor_simulator.error_count
             }
             
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(status, indent=2).encode())
+            self.send_body(200, 'application/json', dump_json(status, indent=True))
             
         except Exception as e:
             logger.error(f"Status check error: {e}")
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
             error_response = {'error': str(e)}
-            self.wfile.write(json.dumps(error_response).encode())
+            self.send_body(500, 'application/json', dump_json(error_response))
+    
+    def render_metrics(self):
+        """Return (status code, content type, body) for the Prometheus metrics"""
+        simulator = self.sensor_simulator
+        metrics = METRICS_TEMPLATE % (
+            simulator.is_connected(),
+            simulator.publish_count,
+            simulator.error_count,
+            len(simulator.sensors)
+        )
+        return 200, 'text/plain; version=0.0.4; charset=utf-8', metrics
     
     def handle_metrics(self):
         """Handle metrics endpoint (Prometheus format)"""
         try:
-            metrics = f"""# HELP smarthome_publisher_mqtt_connected MQTT connection status
-# TYPE smarthome_publisher_mqtt_connected gauge
-smarthome_publisher_mqtt_connected {1 if self.sensor_simulator.client.is_connected() else 0}
-
-# HELP smarthome_publisher_publish_total Total number of publishes
-# TYPE smarthome_publisher_publish_total counter
-smarthome_publisher_publish_total {self.sensor_simulator.publish_count}
-
-# HELP smarthome_publisher_errors_total Total number of errors
-# TYPE smarthome_publisher_errors_total counter
-smarthome_publisher_errors_total {self.sensor_simulator.error_count}
-
-# HELP smarthome_publisher_sensors_count Number of configured sensors
-# TYPE smarthome_publisher_sensors_count gauge
-smarthome_publisher_sensors_count {len(self.sensor_simulator.sensors)}
-"""
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(metrics.encode())
-            
+            self.send_cached(self.render_metrics)
         except Exception as e:
             logger.error(f"Metrics error: {e}")
-            self.send_response(500)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(f'ERROR: {str(e)}'.encode())
+            self.send_body(500, 'text/plain', f'ERROR: {str(e)}'.encode())
     
     def log_message(self, format, *args):
         """Override to reduce HTTP server logging noise"""
@@ -131,11 +222,29 @@ smarthome_publisher_sensors_count {len(self.sensor_simulator.sensors)}
             logger.warning(f"HTTP: {format % args}")
 
 class SensorSimulator:
-    def __init__(self, mqtt_broker, mqtt_port=1883, health_port=8080):
+    def __init__(self, mqtt_broker, mqtt_port=1883, health_port=8080, batch_publish=True,
+                 heartbeat_cycles=10, health_workers=8, qos=0, client_id=None,
+                 max_inflight=20):
         self.mqtt_broker = mqtt_broker
         self.mqtt_port = mqtt_port
         self.health_port = health_port
-        self.client = mqtt.Client()
+        self.health_workers = health_workers
+        self.batch_publish = batch_publish
+        self.heartbeat_cycles = max(1, heartbeat_cycles)
+        # Telemetry QoS. 0 (default) skips the PUBACK round-trip per message; a lost reading is
+        # replaced by the next cycle and gaps show up in the QoS 1 heartbeat. Use 1 if every
+        # reading must be delivered.
+        self.qos = qos
+        # A persistent session lets the broker keep unacknowledged QoS 1 messages across brief
+        # reconnects, but only pays off with a client id that is stable across restarts. Keep one
+        # only for an explicitly configured id; the default is derived from the hostname (the pod
+        # name on Kubernetes) so scaled replicas never collide, but it changes on every rollout
+        # and would leave an orphaned session on the broker each time
+        clean_session = not client_id
+        if not client_id:
+            client_id = f"smart-home-publisher-{socket.gethostname()}"
+        self.client_id = client_id
+        self.client = mqtt.Client(client_id=client_id, clean_session=clean_session)
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
         self.client.on_publish = self.on_publish
@@ -145,11 +254,20 @@ class SensorSimulator:
         self.health_thread = None
         
         # Statistics for monitoring
-        self.publish_count = 0
-        self.error_count = 0
-        self.last_publish_time = None
+        self.publish_counter = StatCounter()
+        self.error_counter = StatCounter()
+        self.last_publish_time = None  # epoch seconds, formatted lazily for /status
         self.running = False
         
+        # Set from on_connect once the broker's CONNACK arrives, cleared on disconnect
+        self._connected_evt = threading.Event()
+        # Set by stop() to cut short the main loop's waits
+        self._stop_evt = threading.Event()
+        
+        # Last reading sent per room, used to skip unchanged readings
+        self._last_sent = {}
+        self._cycle_count = 0
+        
         # Sensor configurations
         self.sensors = {
             'living_room': {
@@ -178,31 +296,95 @@ class SensorSimulator:
             }
         }
         
+        # Unacknowledged QoS 1 publishes allowed in flight before paho queues the rest behind
+        # PUBACKs; 20 is paho's default, raise it when many rooms publish with MQTT_QOS=1
+        self.client.max_inflight_messages_set(max_inflight)
+        
+        # Structure-of-arrays view of the sensor configuration for the per-cycle generation step;
+        # self.sensors stays the readable source of truth
+        self._rooms = tuple(self.sensors)
+        self._temp_base = tuple(c['temp_base'] for c in self.sensors.values())
+        self._temp_variation = tuple(c['temp_variation'] for c in self.sensors.values())
+        self._humidity_base = tuple(c['humidity_base'] for c in self.sensors.values())
+        self._humidity_variation = tuple(c['humidity_variation'] for c in self.sensors.values())
+        
+        # Per-room topic and device id, built once instead of formatted on every publish
+        self._topics = {room: f"smarthome/sensors/{room}" for room in self.sensors}
+        self._device_ids = {room: f"sensor_{room}" for room in self.sensors}
+        
+        # Constant part of each room's JSON payload, built once so only the changing fields
+        # are formatted per cycle
+        self._payload_prefix = {
+            room: ('{"room":%s,"device_id":%s,"unit_temp":"celsius","unit_humidity":"percent",'
+                   % (json.dumps(room), json.dumps(self._device_ids[room]))).encode()
+            for room in self.sensors
+        }
+        self._batch_keys = {room: (json.dumps(room) + ':').encode() for room in self.sensors}
+        
+    @property
+    def publish_count(self):
+        return self.publish_counter.value()
+    
+    @property
+    def error_count(self):
+        return self.error_counter.value()
+    
+    def is_connected(self):
+        """Whether the MQTT broker link is up"""
+        # paho 1.6.1's client.is_connected() stays True after a connection loss when the loop is
+        # driven manually, so track the link from the connect and disconnect callbacks instead
+        return self._connected_evt.is_set()
+    
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             logger.info(f"Connected to MQTT broker at {self.mqtt_broker}:{self.mqtt_port}")
+            # paho opens a fresh socket on every reconnect, so re-apply socket options here
+            self.set_tcp_nodelay()
+            self._connected_evt.set()
         else:
             logger.error(f"Failed to connect to MQTT broker. Return code: {rc}")
-            self.error_count += 1
+            self.error_counter.inc()
     
     def on_disconnect(self, client, userdata, rc):
+        self._connected_evt.clear()
         logger.info("Disconnected from MQTT broker")
         if rc != 0:
-            self.error_count += 1
+            self.error_counter.inc()
     
     def on_publish(self, client, userdata, mid):
         """Callback for successful publish"""
-        self.publish_count += 1
-        self.last_publish_time = datetime.utcnow().isoformat() + 'Z'
+        self.publish_counter.inc()
+        self.last_publish_time = time.time()
+    
+    def format_last_publish_time(self):
+        """Return the last PUBACK time as an ISO-8601 UTC string, or None if nothing was published"""
+        if self.last_publish_time is None:
+            return None
+        return datetime.utcfromtimestamp(self.last_publish_time).isoformat() + 'Z'
+    
+    def set_tcp_nodelay(self):
+        """Disable Nagle so small PUBLISH frames are not held back waiting for delayed ACKs"""
+        sock = self.client.socket()
+        if sock is None:
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            logger.warning(f"Failed to set TCP_NODELAY on MQTT socket: {e}")
     
     def start_health_server(self):
         """Start the health check HTTP server"""
         try:
-            # Create a handler class that has access to the simulator instance
-            def handler_factory(*args, **kwargs):
-                return HealthCheckHandler(self, *args, **kwargs)
+            # Create a handler class that has access to the simulator instance and its own cache
+            handler_class = type('BoundHealthCheckHandler', (HealthCheckHandler,), {
+                'sensor_simulator': self,
+                '_response_cache': {},
+                '_cache_lock': threading.Lock()
+            })
             
-            self.health_server = ThreadedHTTPServer(('0.0.0.0', self.health_port), handler_factory)
+            self.health_server = ThreadedHTTPServer(
+                ('0.0.0.0', self.health_port), handler_class, pool_size=self.health_workers
+            )
             self.health_thread = threading.Thread(target=self.health_server.serve_forever)
             self.health_thread.daemon = True
             self.health_thread.start()
@@ -215,7 +397,7 @@ class SensorSimulator:
             
         except Exception as e:
             logger.error(f"Failed to start health server: {e}")
-            self.error_count += 1
+            self.error_counter.inc()
     
     def stop_health_server(self):
         """Stop the health check HTTP server"""
@@ -229,118 +411,191 @@ class SensorSimulator:
         max_retries = 5
         retry_count = 0
         
-        while retry_count < max_retries:
+        while retry_count < max_retries and not self._stop_evt.is_set():
             try:
                 logger.info(f"Attempting to connect to MQTT broker... (attempt {retry_count + 1}/{max_retries})")
+                self._connected_evt.clear()
                 self.client.connect(self.mqtt_broker, self.mqtt_port, 60)
-                self.client.loop_start()
+                self.set_tcp_nodelay()
                 
-                # Wait for connection to establish
+                # Service the socket on this thread until CONNACK arrives; loop() returns as
+                # soon as the packet is readable, so there is no polling delay. Waits are capped
+                # at 1s so a stop request is noticed promptly
                 connection_timeout = 10
-                start_time = time.time()
-                while not self.client.is_connected() and (time.time() - start_time) < connection_timeout:
-                    time.sleep(0.1)
-                
-                if self.client.is_connected():
-                    return True
-                else:
-                    raise Exception("Connection timeout")
+                deadline = time.monotonic() + connection_timeout
+                while not self._connected_evt.is_set():
+                    if self._stop_evt.is_set():
+                        return False
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Exception("Connection timeout")
+                    rc = self.client.loop(timeout=min(1.0, remaining))
+                    if rc != mqtt.MQTT_ERR_SUCCESS:
+                        raise Exception(f"Connection lost while waiting for CONNACK: {mqtt.error_string(rc)}")
+                return True
                     
             except Exception as e:
                 logger.error(f"Connection attempt {retry_count + 1} failed: {e}")
-                self.error_count += 1
+                self.error_counter.inc()
                 retry_count += 1
                 if retry_count < max_retries:
                     wait_time = min(2 ** retry_count, 30)  # Exponential backoff, max 30 seconds
                     logger.info(f"Waiting {wait_time} seconds before retry...")
-                    time.sleep(wait_time)
+                    # Wake immediately on stop() so SIGTERM is honoured during a broker outage
+                    if self._stop_evt.wait(wait_time):
+                        return False
         
-        logger.error(f"Failed to connect after {max_retries} attempts")
+        if not self._stop_evt.is_set():
+            logger.error(f"Failed to connect after {max_retries} attempts")
         return False
     
-    def simulate_temperature(self, base_temp, variation):
-        """Simulate realistic temperature readings with gradual changes"""
-        # Add some daily variation (assuming time of day affects temperature)
+    def generate_readings(self):
+        """Generate a (temperature, humidity, battery_level) reading for every room in one pass"""
+        # Add some daily variation (assuming time of day affects temperature); the factor is
+        # the same for every room, so it is computed once per cycle
         hour = datetime.now().hour
         daily_factor = 1 + 0.1 * (hour - 12) / 12  # Peak at noon, lowest at midnight
         
-        # Add random variation
-        noise = random.uniform(-variation/2, variation/2)
-        temp = base_temp * daily_factor + noise
+        # Temperature follows the daily factor plus random variation
+        temperatures = [
+            round(base * daily_factor + (random.random() - 0.5) * variation, 2)
+            for base, variation in zip(self._temp_base, self._temp_variation)
+        ]
         
-        return round(temp, 2)
-    
-    def simulate_humidity(self, base_humidity, variation):
-        """Simulate realistic humidity readings"""
-        # Humidity often inversely correlates with temperature
-        noise = random.uniform(-variation/2, variation/2)
-        humidity = base_humidity + noise
+        # Humidity varies randomly around its base, kept within realistic bounds
+        humidities = [
+            round(max(20.0, min(80.0, base + (random.random() - 0.5) * variation)), 2)
+            for base, variation in zip(self._humidity_base, self._humidity_variation)
+        ]
         
-        # Keep humidity within realistic bounds
-        humidity = max(20.0, min(80.0, humidity))
+        # Simulate battery levels for all rooms with a single draw
+        battery_levels = random.choices(BATTERY_LEVELS, k=len(self._rooms))
         
-        return round(humidity, 2)
+        return dict(zip(self._rooms, zip(temperatures, humidities, battery_levels)))
     
-    def generate_sensor_data(self, room):
-        """Generate sensor data for a specific room"""
-        config = self.sensors[room]
-        
-        temperature = self.simulate_temperature(
-            config['temp_base'], 
-            config['temp_variation']
+    def encode_sensor_data(self, room, timestamp, timestamp_ns, reading):
+        """Serialize a reading to JSON bytes by splicing the changing fields into the room's prefix"""
+        temperature, humidity, battery_level = reading
+        fields = (
+            '"timestamp":"%s","timestamp_ns":%d,"temperature":%r,"humidity":%r,"battery_level":%d}' % (
+                timestamp, timestamp_ns, temperature, humidity, battery_level
+            )
         )
-        
-        humidity = self.simulate_humidity(
-            config['humidity_base'], 
-            config['humidity_variation']
+        return self._payload_prefix[room] + fields.encode()
+    
+    def cycle_timestamp(self):
+        """Return the current UTC time as (ISO-8601 string, epoch nanoseconds), computed once per publish cycle"""
+        timestamp_ns = time.time_ns()
+        dt = datetime.utcfromtimestamp(timestamp_ns // 1_000_000_000).replace(
+            microsecond=timestamp_ns // 1000 % 1_000_000
         )
-        
-        # Create sensor data payload
-        sensor_data = {
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
-            'room': room,
-            'temperature': temperature,
-            'humidity': humidity,
-            'unit_temp': 'celsius',
-            'unit_humidity': 'percent',
-            'device_id': f"sensor_{room}",
-            'battery_level': random.randint(70, 100)  # Simulate battery level
-        }
-        
-        return sensor_data
+        return dt.strftime('%Y-%m-%dT%H:%M:%S.%f') + 'Z', timestamp_ns
     
     def publish_sensor_data(self):
         """Publish sensor data for all rooms"""
-        if not self.client.is_connected():
+        if not self.is_connected():
             logger.warning("MQTT client not connected. Attempting to reconnect...")
             if not self.connect():
-                logger.error("Failed to reconnect to MQTT broker")
+                if not self._stop_evt.is_set():
+                    logger.error("Failed to reconnect to MQTT broker")
                 return
         
-        for room in self.sensors.keys():
+        # Every Nth cycle publish all rooms regardless, so downstream stale-detection keeps working
+        force = self._cycle_count % self.heartbeat_cycles == 0
+        self._cycle_count += 1
+        timestamp, timestamp_ns = self.cycle_timestamp()
+        
+        if force:
+            self.publish_heartbeat(timestamp)
+        
+        if self.batch_publish:
+            self.publish_batch(timestamp, timestamp_ns, force)
+            return
+        
+        # Build every payload first so serialization never sits between two socket writes
+        pending = [
+            (room, reading, self._topics[room], self.encode_sensor_data(room, timestamp, timestamp_ns, reading))
+            for room, reading in self.generate_readings().items()
+            if force or self._last_sent.get(room) != reading
+        ]
+        
+        # publish() never waits for a PUBACK, so the packets go out back-to-back; bind it once
+        # to skip the attribute lookups per room
+        publish = self.client.publish
+        for room, reading, topic, payload in pending:
             try:
-                sensor_data = self.generate_sensor_data(room)
-                topic = f"smarthome/sensors/{room}"
-                
                 # Publish the data
-                result = self.client.publish(
+                result = publish(
                     topic, 
-                    json.dumps(sensor_data), 
-                    qos=1,
+                    payload, 
+                    qos=self.qos,
                     retain=False
                 )
                 
                 if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                    logger.info(f"Published data for {room}: "
-                              f"Temp={sensor_data['temperature']}°C, "
-                              f"Humidity={sensor_data['humidity']}%")
+                    self._last_sent[room] = reading
+                    logger.info("Published data for %s: Temp=%s°C, Humidity=%s%%",
+                                room, reading[0], reading[1])
                 else:
-                    logger.error(f"Failed to publish data for {room}, return code: {result.rc}")
-                    self.error_count += 1
+                    logger.error("Failed to publish data for %s, return code: %s", room, result.rc)
+                    self.error_counter.inc()
                 
             except Exception as e:
-                logger.error(f"Error publishing data for {room}: {e}")
-                self.error_count += 1
+                logger.error("Error publishing data for %s: %s", room, e)
+                self.error_counter.inc()
+    
+    def publish_heartbeat(self, timestamp):
+        """Publish the cycle sequence number at QoS 1 so consumers can detect missed cycles"""
+        try:
+            heartbeat = {
+                'sequence': self._cycle_count,
+                'timestamp': timestamp,
+                'sensors_count': len(self.sensors)
+            }
+            result = self.client.publish(HEARTBEAT_TOPIC, dump_json(heartbeat), qos=1, retain=False)
+            if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                logger.error("Failed to publish heartbeat, return code: %s", result.rc)
+                self.error_counter.inc()
+        except Exception as e:
+            logger.error("Error publishing heartbeat: %s", e)
+            self.error_counter.inc()
+    
+    def publish_batch(self, timestamp, timestamp_ns, force=False):
+        """Publish changed rooms as one aggregated payload so a single message covers the cycle"""
+        try:
+            readings = self.generate_readings()
+            changed = [
+                room for room, reading in readings.items()
+                if force or self._last_sent.get(room) != reading
+            ]
+            
+            if not changed:
+                logger.debug("No sensor values changed, skipping publish")
+                return
+            
+            payload = b'{' + b','.join(
+                self._batch_keys[room] + self.encode_sensor_data(room, timestamp, timestamp_ns, readings[room])
+                for room in changed
+            ) + b'}'
+            
+            result = self.client.publish(
+                BATCH_TOPIC,
+                payload,
+                qos=self.qos,
+                retain=False
+            )
+            
+            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                for room in changed:
+                    self._last_sent[room] = readings[room]
+                logger.info("Published batch for %d rooms to %s", len(changed), BATCH_TOPIC)
+            else:
+                logger.error("Failed to publish batch, return code: %s", result.rc)
+                self.error_counter.inc()
+            
+        except Exception as e:
+            logger.error("Error publishing sensor batch: %s", e)
+            self.error_counter.inc()
     
     def run(self):
         """Main loop to continuously publish sensor data"""
@@ -348,43 +603,92 @@ class SensorSimulator:
         self.start_health_server()
         
         if not self.connect():
-            logger.error("Failed to connect to MQTT broker. Exiting.")
+            if not self._stop_evt.is_set():
+                logger.error("Failed to connect to MQTT broker. Exiting.")
             return
         
         self.running = True
         logger.info("Starting sensor data simulation...")
-        logger.info(f"Publishing interval: 30 seconds")
+        logger.info(f"Publishing interval: {PUBLISH_INTERVAL} seconds")
+        logger.info(f"Publish mode: {'batch (' + BATCH_TOPIC + ')' if self.batch_publish else 'per-room'}")
         logger.info(f"Configured sensors: {list(self.sensors.keys())}")
         
         try:
+            next_publish = time.monotonic()
             while self.running:
-                self.publish_sensor_data()
-                time.sleep(30)  # Publish every 30 seconds
+                now = time.monotonic()
+                if now >= next_publish:
+                    self.publish_sensor_data()
+                    
+                    # Schedule on a fixed grid so publish time does not accumulate as drift
+                    next_publish += PUBLISH_INTERVAL
+                    if next_publish < time.monotonic():
+                        # Fell behind (e.g. a slow reconnect): skip missed slots instead of bursting
+                        next_publish = time.monotonic() + PUBLISH_INTERVAL
+                    continue
+                
+                # Run paho's network I/O (PUBACKs, keepalive pings) on this thread until the next
+                # publish is due, so callbacks and counters never cross threads. The 1s cap
+                # bounds how long stop() takes to be noticed.
+                rc = self.client.loop(timeout=min(1.0, next_publish - now))
+                if rc != mqtt.MQTT_ERR_SUCCESS:
+                    # Connection lost; nothing else reconnects a manually driven client
+                    self._connected_evt.clear()
+                    logger.warning(f"Lost connection to MQTT broker, reconnecting: {mqtt.error_string(rc)}")
+                    if not self.connect():
+                        if self._stop_evt.is_set():
+                            break
+                        logger.error("Failed to reconnect to MQTT broker")
+                        # Back off before the next attempt instead of spinning on a dead socket
+                        if self._stop_evt.wait(PUBLISH_INTERVAL):
+                            break
                 
         except KeyboardInterrupt:
             logger.info("Stopping sensor simulation...")
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
-            self.error_count += 1
+            self.error_counter.inc()
         finally:
             self.running = False
-            self.client.loop_stop()
             self.client.disconnect()
             self.stop_health_server()
             logger.info("Sensor simulator stopped")
+    
+    def stop(self):
+        """Ask the main loop to exit; safe to call from a signal handler"""
+        self.running = False
+        self._stop_evt.set()
 
 def main():
     # Get configuration from environment variables
     mqtt_broker = os.getenv('MQTT_BROKER', 'localhost')
     mqtt_port = int(os.getenv('MQTT_PORT', '1883'))
     health_port = int(os.getenv('HEALTH_PORT', '8080'))
+    batch_publish = os.getenv('MQTT_BATCH_PUBLISH', 'true').lower() in ('1', 'true', 'yes')
+    heartbeat_cycles = int(os.getenv('PUBLISH_HEARTBEAT_CYCLES', '10'))
+    health_workers = int(os.getenv('HEALTH_WORKERS', '8'))
+    qos = int(os.getenv('MQTT_QOS', '0'))
+    client_id = os.getenv('MQTT_CLIENT_ID')
+    max_inflight = int(os.getenv('MQTT_MAX_INFLIGHT', '20'))
     
     logger.info("=== Smart Home Sensor Publisher ===")
     logger.info(f"MQTT Broker: {mqtt_broker}:{mqtt_port}")
     logger.info(f"Health Check Port: {health_port}")
+    logger.info(f"Telemetry QoS: {qos}")
     
     # Create and run sensor simulator
-    simulator = SensorSimulator(mqtt_broker, mqtt_port, health_port)
+    simulator = SensorSimulator(
+        mqtt_broker, mqtt_port, health_port, batch_publish, heartbeat_cycles, health_workers, qos,
+        client_id, max_inflight
+    )
+    logger.info(f"MQTT Client ID: {simulator.client_id}")
+    
+    # Docker and Kubernetes stop containers with SIGTERM; wake the main loop right away
+    def handle_sigterm(signum, frame):
+        logger.info("Received SIGTERM, stopping sensor simulation...")
+        simulator.stop()
+    
+    signal.signal(signal.SIGTERM, handle_sigterm)
     simulator.run()
 
 if __name__ == "__main__":
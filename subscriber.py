@@ -3,17 +3,28 @@
 Smart Home Data Subscriber
 Subscribes to MQTT sensor data and stores it in InfluxDB
 """
+import asyncio
 import json
 import os
 import logging
+import multiprocessing
+import queue
+import signal
+import socket
 import threading
 import time
 from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from socketserver import ThreadingMixIn
+from http import HTTPStatus
+from urllib.parse import parse_qs
 import paho.mqtt.client as mqtt
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client import InfluxDBClient, WritePrecision
+from influxdb_client.client.write_api import WriteOptions
+from subscriber_fast import encode_point
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Configure logging
 logging.basicConfig(
@@ -22,29 +33,147 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    """Thread-safe HTTP Server"""
-    daemon_threads = True
+def dump_json(obj, indent=False):
+    """Serialize obj to JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode()
+
+def load_json(data):
+    """Parse JSON from bytes without an intermediate str, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Topic filter covering every per-room topic and the aggregated batch topic
+SENSOR_TOPICS = "smarthome/sensors/+"
+
+# Kernel receive buffer requested for the MQTT socket, so bursts are absorbed while the
+# callback thread is busy
+MQTT_RCVBUF_BYTES = 4 << 20
+
+# Aggregated topic used by the publisher in batch mode; payload is keyed by room name
+BATCH_TOPIC = "smarthome/sensors/all"
+
+# Prometheus exposition body; only the values are formatted per scrape
+METRICS_TEMPLATE = b"""# HELP smarthome_subscriber_mqtt_connected MQTT connection status
+# TYPE smarthome_subscriber_mqtt_connected gauge
+smarthome_subscriber_mqtt_connected %d
+
+# HELP smarthome_subscriber_influxdb_connected InfluxDB connection status
+# TYPE smarthome_subscriber_influxdb_connected gauge
+smarthome_subscriber_influxdb_connected %d
+
+# HELP smarthome_subscriber_messages_received_total Total MQTT messages received (a batch message carries several readings)
+# TYPE smarthome_subscriber_messages_received_total counter
+smarthome_subscriber_messages_received_total %d
+
+# HELP smarthome_subscriber_readings_received_total Total sensor readings received, counting each reading in a batch message
+# TYPE smarthome_subscriber_readings_received_total counter
+smarthome_subscriber_readings_received_total %d
+
+# HELP smarthome_subscriber_messages_written_total Total readings written to InfluxDB
+# TYPE smarthome_subscriber_messages_written_total counter
+smarthome_subscriber_messages_written_total %d
+
+# HELP smarthome_subscriber_errors_total Total number of errors
+# TYPE smarthome_subscriber_errors_total counter
+smarthome_subscriber_errors_total %d
+
+# HELP smarthome_subscriber_messages_dropped_total Readings dropped because the write queue was full
+# TYPE smarthome_subscriber_messages_dropped_total counter
+smarthome_subscriber_messages_dropped_total %d
+"""
+
+# Pooled InfluxDB HTTP connections. The client defaults to cpu_count() * 5, but only the batching
+# writer and /status health checks use the pool, so shrink it to what they can actually occupy
+INFLUX_POOL_MAXSIZE = 4
+
+# Docker and Kubernetes SIGKILL a container 10s after SIGTERM, so draining the writer and flushing
+# the last batches must finish within this many seconds to not lose them
+SHUTDOWN_TIMEOUT = 8
+
+# Part of SHUTDOWN_TIMEOUT the writer thread gets to drain the queue; the rest bounds the final flush
+WRITER_JOIN_TIMEOUT = 2
+
+# Milliseconds one InfluxDB request, the longest retry backoff and a batch's whole retry window may
+# each take. The retry window is only checked before a retry, so a batch retrying when SIGTERM
+# arrives can still take all three in turn; they must add up to the final flush, because the
+# client's write thread has to be idle by then for the interpreter to exit
+INFLUX_RETRY_BUDGET_MS = (SHUTDOWN_TIMEOUT - WRITER_JOIN_TIMEOUT) * 1000 // 3
 
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    """HTTP request handler for health checks"""
+# Seconds the supervisor waits before restarting a crashed worker, doubling on each crash in a row;
+# a worker that ran for at least the maximum is considered healthy again
+WORKER_RESTART_DELAY_MIN = 1
+WORKER_RESTART_DELAY_MAX = 60
+
+# Upper bound on readings buffered between the MQTT thread and the InfluxDB writer
+QUEUE_MAXSIZE = 10_000
+
+# Most readings the writer hands to the InfluxDB client in one call
+WRITE_BATCH_SIZE = 500
+
+# Drained batches the InfluxDB client may coalesce into one request (batch_size counts records,
+# and each record is a whole drained batch)
+WRITE_FLUSH_BATCHES = 10
+
+class ShardedCounter:
+    """Statistical counter with one shard per thread: increments only touch the calling
+    thread's shard, and the rare reads from /metrics and /status sum all shards"""
+    
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
     
-    def __init__(self, subscriber, *args, **kwargs):
+    def _register_shard(self):
+        """Create and register the calling thread's shard (once per thread)"""
+        shard = [0]
+        with self._shards_lock:
+            self._shards.append(shard)
+        self._local.shard = shard
+        return shard
+    
+    def inc(self, n=1):
+        """Increment by n; each shard has a single writer, so no increment is lost"""
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._register_shard()
+        shard[0] += n
+    
+    def value(self):
+        """Return the total across all shards, including those of threads that have exited"""
+        return sum(shard[0] for shard in self._shards)
+
+HTTP_KEEPALIVE_TIMEOUT = 20
+
+class HealthCheckHandler:
+    """Health check endpoints; each handler returns (status, content type, body)"""
+    
+    # Paths whose handlers block on I/O and must run off the event loop
+    BLOCKING_PATHS = frozenset(['/status'])
+    
+    # Path -> handler method name; every handler takes the raw query string
+    _ROUTES = {
+        '/health': 'handle_health_check',
+        '/status': 'handle_status_check',
+        '/metrics': 'handle_metrics'
+    }
+    
+    def __init__(self, subscriber):
         self.subscriber = subscriber
-        super().__init__(*args, **kwargs)
+        # Bind the handlers once so dispatch is a single dict lookup
+        self._routes = {path: getattr(self, name) for path, name in self._ROUTES.items()}
     
-    def do_GET(self):
+    def do_GET(self, path, query=''):
         """Handle GET requests"""
-        if self.path == '/health':
-            self.handle_health_check()
-        elif self.path == '/status':
-            self.handle_status_check()
-        elif self.path == '/metrics':
-            self.handle_metrics()
-        else:
-            self.send_error(404, 'Not Found')
+        handler = self._routes.get(path)
+        if handler is None:
+            return 404, 'text/plain', b'Not Found'
+        return handler(query)
     
-    def handle_health_check(self):
+    def handle_health_check(self, query=''):
         """Handle basic health check endpoint"""
         try:
             # Check if both MQTT and InfluxDB connections are healthy
@@ -52,30 +181,22 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
             influx_ok = self.subscriber.influx_client is not None
             
             if mqtt_ok and influx_ok:
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(b'OK')
+                return 200, 'text/plain', b'OK'
+            if not mqtt_ok and not influx_ok:
+                return 503, 'text/plain', b'MQTT_AND_INFLUXDB_DISCONNECTED'
+            elif not mqtt_ok:
+                return 503, 'text/plain', b'MQTT_DISCONNECTED'
             else:
-                self.send_response(503)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                if not mqtt_ok and not influx_ok:
-                    self.wfile.write(b'MQTT_AND_INFLUXDB_DISCONNECTED')
-                elif not mqtt_ok:
-                    self.wfile.write(b'MQTT_DISCONNECTED')
-                else:
-                    self.wfile.write(b'INFLUXDB_DISCONNECTED')
+                return 503, 'text/plain', b'INFLUXDB_DISCONNECTED'
         except Exception as e:
             logger.error(f"Health check error: {e}")
-            self.send_response(500)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(f'ERROR: {str(e)}'.encode())
+            return 500, 'text/plain', f'ERROR: {str(e)}'.encode()
     
-    def handle_status_check(self):
-        """Handle detailed status endpoint"""
+    def handle_status_check(self, query=''):
+        """Handle detailed status endpoint; compact JSON unless ?pretty=1 is given"""
         try:
+            pretty = parse_qs(query).get('pretty') == ['1']
+            
             # Test InfluxDB connection
             influxdb_healthy = False
             if self.subscriber.influx_client:
@@ -92,7 +213,7 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
                 'mqtt': {
                     'connected': self.subscriber.mqtt_client.is_connected(),
                     'broker': f"{self.subscriber.mqtt_broker}:{self.subscriber.mqtt_port}",
-                    'subscribed_topics': ['smarthome/sensors/+']
+                    'subscribed_topics': [self.subscriber.subscription]
                 },
                 'influxdb': {
                     'connected': influxdb_healthy,
@@ -102,75 +223,178 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
                 },
                 'statistics': {
                     'messages_received': self.subscriber.message_count,
+                    'readings_received': self.subscriber.reading_count,
                     'messages_written': self.subscriber.write_count,
                     'errors': self.subscriber.error_count,
+                    'messages_dropped': self.subscriber.dropped_count,
                     'last_message_time': self.subscriber.last_message_time,
                     'last_write_time': self.subscriber.last_write_time
                 }
             }
             
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(status, indent=2).encode())
+            return 200, 'application/json', dump_json(status, indent=pretty)
             
         except Exception as e:
             logger.error(f"Status check error: {e}")
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
             error_response = {'error': str(e)}
-            self.wfile.write(json.dumps(error_response).encode())
+            return 500, 'application/json', dump_json(error_response)
     
-    def handle_metrics(self):
+    def handle_metrics(self, query=''):
         """Handle metrics endpoint (Prometheus format)"""
         try:
-            metrics = f"""# HELP smarthome_subscriber_mqtt_connected MQTT connection status
-# TYPE smarthome_subscriber_mqtt_connected gauge
-smarthome_subscriber_mqtt_connected {1 if self.subscriber.mqtt_client.is_connected() else 0}
-
-# HELP smarthome_subscriber_influxdb_connected InfluxDB connection status
-# TYPE smarthome_subscriber_influxdb_connected gauge
-smarthome_subscriber_influxdb_connected {1 if self.subscriber.influx_client else 0}
-
-# HELP smarthome_subscriber_messages_received_total Total MQTT messages received
-# TYPE smarthome_subscriber_messages_received_total counter
-smarthome_subscriber_messages_received_total {self.subscriber.message_count}
-
-# HELP smarthome_subscriber_messages_written_total Total messages written to InfluxDB
-# TYPE smarthome_subscriber_messages_written_total counter
-smarthome_subscriber_messages_written_total {self.subscriber.write_count}
-
-# HELP smarthome_subscriber_errors_total Total number of errors
-# TYPE smarthome_subscriber_errors_total counter
-smarthome_subscriber_errors_total {self.subscriber.error_count}
-"""
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(metrics.encode())
+            subscriber = self.subscriber
+            metrics = METRICS_TEMPLATE % (
+                subscriber.mqtt_client.is_connected(),
+                subscriber.influx_client is not None,
+                subscriber.message_count,
+                subscriber.reading_count,
+                subscriber.write_count,
+                subscriber.error_count,
+                subscriber.dropped_count
+            )
+            return 200, 'text/plain; version=0.0.4; charset=utf-8', metrics
             
         except Exception as e:
             logger.error(f"Metrics error: {e}")
-            self.send_response(500)
-            self.send_header('Content-type', 'text/plain')
-            self.end_headers()
-            self.wfile.write(f'ERROR: {str(e)}'.encode())
-    
-    def log_message(self, format, *args):
-        """Override to reduce HTTP server logging noise"""
-        # Only log errors and important requests
-        if '500' in format or '404' in format:
-            logger.warning(f"HTTP: {format % args}")
+            return 500, 'text/plain', f'ERROR: {str(e)}'.encode()
+
+class HealthServer:
+    """Single-threaded asyncio HTTP/1.1 server for the health endpoints"""
+    
+    def __init__(self, handler, host, port):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self._loop = None
+        self._server = None
+        self._thread = None
+        # Open connection task -> its stream writer
+        self._connections = {}
+    
+    def start(self):
+        """Bind the listening socket and serve from a daemon event loop thread"""
+        loop = asyncio.new_event_loop()
+        # Bind in the calling thread so address errors surface to the caller
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self.handle_connection, self.host, self.port)
+            )
+        except BaseException:
+            loop.close()
+            raise
+        self._loop = loop
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Close the listener and any kept-alive connections, then stop the loop"""
+        if self._thread is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        future.result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+    
+    async def _shutdown(self):
+        self._server.close()
+        # Closing the transports wakes idle keep-alive readers with EOF; wait for them to return
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+    
+    async def read_headers(self, reader, keep_alive):
+        """Drain the request headers and return (keep_alive, has_body)"""
+        has_body = False
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                return keep_alive, has_body
+            name, _, value = line.decode('latin-1').partition(':')
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == 'connection':
+                keep_alive = value == 'keep-alive' or (keep_alive and value != 'close')
+            elif name == 'transfer-encoding' or (name == 'content-length' and value != '0'):
+                has_body = True
+    
+    async def handle_connection(self, reader, writer):
+        """Serve GET requests on one connection until it closes or idles out"""
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), HTTP_KEEPALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                
+                parts = request_line.decode('latin-1').split()
+                keep_alive = len(parts) == 3 and parts[2] == 'HTTP/1.1'
+                
+                # A client trickling headers must not hold the connection open indefinitely
+                try:
+                    keep_alive, has_body = await asyncio.wait_for(
+                        self.read_headers(reader, keep_alive), HTTP_KEEPALIVE_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    break
+                
+                # Request bodies are never read, so a connection that carried one cannot be reused:
+                # the body would be parsed as the next request line
+                if has_body or (len(parts) == 3 and parts[0] != 'GET'):
+                    keep_alive = False
+                
+                if len(parts) != 3:
+                    code, content_type, body = 400, 'text/plain', b'Bad Request'
+                    keep_alive = False
+                elif parts[0] != 'GET':
+                    code, content_type, body = 405, 'text/plain', b'Method Not Allowed'
+                else:
+                    path, _, query = parts[1].partition('?')
+                    if path in self.handler.BLOCKING_PATHS:
+                        code, content_type, body = await asyncio.to_thread(self.handler.do_GET, path, query)
+                    else:
+                        code, content_type, body = self.handler.do_GET(path, query)
+                
+                if code >= 400 and code != 503:
+                    # Only log errors to reduce HTTP server logging noise
+                    logger.warning(f"HTTP: \"{request_line.decode('latin-1').strip()}\" {code}")
+                
+                writer.write(
+                    b'HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n' % (
+                        code,
+                        HTTPStatus(code).phrase.encode(),
+                        content_type.encode(),
+                        len(body),
+                        b'keep-alive' if keep_alive else b'close'
+                    ) + body
+                )
+                await writer.drain()
+                
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
 
 class SensorDataSubscriber:
     def __init__(self, mqtt_broker, mqtt_port, influxdb_url, influxdb_token, 
-                 influxdb_org, influxdb_bucket, health_port=8080):
+                 influxdb_org, influxdb_bucket, health_port=8080, shared_group='', client_id='',
+                 qos=0):
         # MQTT Configuration
         self.mqtt_broker = mqtt_broker
         self.mqtt_port = mqtt_port
-        self.mqtt_client = mqtt.Client()
+        # A shared subscription makes the broker load-balance messages across every subscriber in
+        # the group instead of delivering each message to all of them
+        self.subscription = f"$share/{shared_group}/{SENSOR_TOPICS}" if shared_group else SENSOR_TOPICS
+        self.qos = qos
+        self.mqtt_client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5, transport="tcp")
         self.mqtt_client.on_connect = self.on_mqtt_connect
         self.mqtt_client.on_message = self.on_mqtt_message
         self.mqtt_client.on_disconnect = self.on_mqtt_disconnect
@@ -188,30 +412,61 @@ class SensorDataSubscriber:
         # Health check server
         self.health_port = health_port
         self.health_server = None
-        self.health_thread = None
         
         # Statistics for monitoring
-        self.message_count = 0
-        self.write_count = 0
-        self.error_count = 0
+        self.message_counter = ShardedCounter()
+        # Batch messages carry one reading per room, so readings are counted separately from messages
+        self.reading_counter = ShardedCounter()
+        self.write_counter = ShardedCounter()
+        self.error_counter = ShardedCounter()
+        self.dropped_counter = ShardedCounter()
         self.last_message_time = None
         self.last_write_time = None
+        # (epoch second, formatted string) shared by the MQTT and writer callback threads
+        self._timestamp_cache = (0, '')
         self.running = False
+        self._stop_evt = threading.Event()
         
-        # Thread lock for statistics
-        self._stats_lock = threading.Lock()
+        # Readings waiting for the InfluxDB writer thread; bounded for backpressure
+        self._queue = queue.Queue(maxsize=QUEUE_MAXSIZE)
+        self._writer_thread = None
+    
+    @property
+    def message_count(self):
+        return self.message_counter.value()
+    
+    @property
+    def reading_count(self):
+        return self.reading_counter.value()
+    
+    @property
+    def write_count(self):
+        return self.write_counter.value()
+    
+    @property
+    def error_count(self):
+        return self.error_counter.value()
+    
+    @property
+    def dropped_count(self):
+        return self.dropped_counter.value()
+    
+    def utc_timestamp(self):
+        """Return the current UTC time as an ISO-8601 string, formatted at most once per second"""
+        now = int(time.time())
+        cached_second, cached = self._timestamp_cache
+        if now != cached_second:
+            cached = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now))
+            self._timestamp_cache = (now, cached)
+        return cached
     
     def start_health_server(self):
         """Start the health check HTTP server"""
         try:
-            # Create a handler class that has access to the subscriber instance
-            def handler_factory(*args, **kwargs):
-                return HealthCheckHandler(self, *args, **kwargs)
-            
-            self.health_server = ThreadedHTTPServer(('0.0.0.0', self.health_port), handler_factory)
-            self.health_thread = threading.Thread(target=self.health_server.serve_forever)
-            self.health_thread.daemon = True
-            self.health_thread.start()
+            # Only keep the server once it is bound, so a failed start leaves nothing to stop
+            health_server = HealthServer(HealthCheckHandler(self), '0.0.0.0', self.health_port)
+            health_server.start()
+            self.health_server = health_server
             
             logger.info(f"Health check server started on port {self.health_port}")
             logger.info(f"Health endpoints:")
@@ -221,196 +476,201 @@ class SensorDataSubscriber:
             
         except Exception as e:
             logger.error(f"Failed to start health server: {e}")
-            with self._stats_lock:
-                self.error_count += 1
+            self.error_counter.inc()
     
     def stop_health_server(self):
         """Stop the health check HTTP server"""
         if self.health_server:
-            self.health_server.shutdown()
-            self.health_server.server_close()
+            self.health_server.stop()
             logger.info("Health check server stopped")
     
     def connect_influxdb(self):
-        """Connect to InfluxDB with retry logic"""
-        max_retries = 5
-        retry_count = 0
-        
-        while retry_count < max_retries:
-            try:
-                logger.info(f"Attempting to connect to InfluxDB... (attempt {retry_count + 1}/{max_retries})")
-                
-                self.influx_client = InfluxDBClient(
-                    url=self.influxdb_url,
-                    token=self.influxdb_token,
-                    org=self.influxdb_org
-                )
-                
-                # Test connection
-                health = self.influx_client.health()
-                if health.status == "pass":
-                    logger.info("Connected to InfluxDB successfully")
-                    self.write_api = self.influx_client.write_api(write_options=SYNCHRONOUS)
-                    return True
-                else:
-                    raise Exception(f"InfluxDB health check failed: {health.message}")
-                    
-            except Exception as e:
-                logger.error(f"InfluxDB connection attempt {retry_count + 1} failed: {e}")
-                with self._stats_lock:
-                    self.error_count += 1
-                
-                retry_count += 1
-                if retry_count < max_retries:
-                    wait_time = min(2 ** retry_count, 30)  # Exponential backoff, max 30 seconds
-                    logger.info(f"Waiting {wait_time} seconds before retry...")
-                    time.sleep(wait_time)
+        """Create the InfluxDB client and batching write API; failed writes are retried by the client"""
+        try:
+            # Line protocol compresses well, so gzip the write requests
+            self.influx_client = InfluxDBClient(
+                url=self.influxdb_url,
+                token=self.influxdb_token,
+                org=self.influxdb_org,
+                enable_gzip=True,
+                connection_pool_maxsize=INFLUX_POOL_MAXSIZE,
+                timeout=INFLUX_RETRY_BUDGET_MS
+            )
+            # Batch points in the background and let the client handle retries with exponential
+            # backoff, so neither the MQTT thread nor the writer ever sleeps on a failed write
+            self.write_api = self.influx_client.write_api(
+                write_options=WriteOptions(
+                    batch_size=WRITE_FLUSH_BATCHES,
+                    flush_interval=1000,
+                    jitter_interval=200,
+                    retry_interval=500,
+                    max_retries=5,
+                    max_retry_delay=INFLUX_RETRY_BUDGET_MS,
+                    exponential_base=2,
+                    # The defaults (3 and 5 minutes) let close() outlast the container's stop timeout
+                    max_retry_time=INFLUX_RETRY_BUDGET_MS,
+                    max_close_wait=(SHUTDOWN_TIMEOUT - WRITER_JOIN_TIMEOUT) * 1000
+                ),
+                success_callback=self.on_write_success,
+                error_callback=self.on_write_error,
+                retry_callback=self.on_write_retry
+            )
+        except Exception as e:
+            logger.error(f"Failed to create InfluxDB client: {e}")
+            self.error_counter.inc()
+            return False
         
-        logger.error(f"Failed to connect to InfluxDB after {max_retries} attempts")
-        return False
+        # An unhealthy InfluxDB is not fatal: writes made while it is down go through the retry policy
+        health = self.influx_client.health()
+        if health.status == "pass":
+            logger.info("Connected to InfluxDB successfully")
+        else:
+            logger.warning(f"InfluxDB health check failed: {health.message}")
+        return True
+    
+    def tune_mqtt_socket(self):
+        """Disable Nagle and enlarge the receive buffer on the current MQTT socket"""
+        sock = self.mqtt_client.socket()
+        if sock is None:
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MQTT_RCVBUF_BYTES)
+        except OSError as e:
+            logger.warning(f"Failed to tune MQTT socket options: {e}")
     
-    def on_mqtt_connect(self, client, userdata, flags, rc):
+    def on_mqtt_connect(self, client, userdata, flags, rc, properties=None):
         """Callback for MQTT connection"""
         if rc == 0:
             logger.info(f"Connected to MQTT broker at {self.mqtt_broker}:{self.mqtt_port}")
-            # Subscribe to all sensor topics
-            client.subscribe("smarthome/sensors/+")
-            logger.info("Subscribed to smarthome/sensors/+ topics")
+            # paho opens a fresh socket on every reconnect, so re-apply socket options here
+            self.tune_mqtt_socket()
+            # Subscribe to all sensor topics. QoS 0 by default: telemetry tolerates loss, and QoS 1/2
+            # deliveries are acknowledged one by one. paho sends each PUBACK only after
+            # on_mqtt_message returns, which is immediate since the callback just enqueues
+            client.subscribe(self.subscription, qos=self.qos)
+            logger.info(f"Subscribed to {self.subscription} topics")
         else:
             logger.error(f"Failed to connect to MQTT broker. Return code: {rc}")
-            with self._stats_lock:
-                self.error_count += 1
+            self.error_counter.inc()
     
-    def on_mqtt_disconnect(self, client, userdata, rc):
+    def on_mqtt_disconnect(self, client, userdata, rc, properties=None):
         """Callback for MQTT disconnection"""
         logger.info("Disconnected from MQTT broker")
         if rc != 0:
-            with self._stats_lock:
-                self.error_count += 1
+            self.error_counter.inc()
     
     def on_mqtt_message(self, client, userdata, msg):
         """Callback for MQTT message received"""
         try:
             # Update statistics
-            with self._stats_lock:
-                self.message_count += 1
-                self.last_message_time = datetime.utcnow().isoformat() + 'Z'
+            self.message_counter.inc()
+            self.last_message_time = self.utc_timestamp()
             
             # Decode the message
             topic = msg.topic
-            payload = json.loads(msg.payload.decode())
+            payload = load_json(msg.payload)
             
-            logger.info(f"Received data from {topic}: {payload}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Received data from %s: %s", topic, payload)
             
-            # Write to InfluxDB
-            self.write_to_influxdb(payload)
+            # Queue for the writer thread, splitting aggregated batches into per-room records
+            if topic == BATCH_TOPIC:
+                if not isinstance(payload, dict):
+                    raise ValueError(f"batch payload is not a JSON object: {payload!r}")
+                for sensor_data in payload.values():
+                    self.enqueue_reading(sensor_data)
+            else:
+                self.enqueue_reading(payload)
             
         except json.JSONDecodeError as e:
             logger.error(f"Failed to decode JSON message: {e}")
-            with self._stats_lock:
-                self.error_count += 1
+            self.error_counter.inc()
         except Exception as e:
             logger.error(f"Error processing MQTT message: {e}")
-            with self._stats_lock:
-                self.error_count += 1
+            self.error_counter.inc()
     
-    def write_to_influxdb(self, sensor_data):
-        """Write sensor data to InfluxDB with retry logic"""
-        max_retries = 3
-        retry_count = 0
-        
-        while retry_count < max_retries:
+    def enqueue_reading(self, sensor_data):
+        """Hand a reading to the writer thread, dropping it if the queue is full"""
+        # Reject anything but an object here; the writer encodes a whole batch at a time, so a
+        # reading it cannot even index must never reach it
+        if not isinstance(sensor_data, dict):
+            logger.error(f"Skipping sensor reading that is not a JSON object: {sensor_data!r}")
+            self.error_counter.inc()
+            return
+        self.reading_counter.inc()
+        try:
+            self._queue.put_nowait(sensor_data)
+        except queue.Full:
+            logger.warning("Write queue full, dropping reading")
+            self.dropped_counter.inc()
+    
+    def writer_loop(self):
+        """Drain queued readings in batches and write each batch to InfluxDB in one call"""
+        while self.running or not self._queue.empty():
             try:
-                # Check if we have a valid write API
-                if not self.write_api:
-                    logger.warning("InfluxDB write API not available. Attempting to reconnect...")
-                    if not self.connect_influxdb():
-                        raise Exception("Failed to reconnect to InfluxDB")
-                
-                # Create InfluxDB point with additional fields if available
-                point = Point("sensor_data") \
-                    .tag("room", sensor_data['room']) \
-                    .field("temperature", float(sensor_data['temperature'])) \
-                    .field("humidity", float(sensor_data['humidity'])) \
-                    .time(sensor_data['timestamp'])
-                
-                # Add optional fields if present
-                if 'device_id' in sensor_data:
-                    point = point.tag("device_id", sensor_data['device_id'])
-                
-                if 'battery_level' in sensor_data:
-                    point = point.field("battery_level", int(sensor_data['battery_level']))
-                
-                # Write to InfluxDB
-                self.write_api.write(
-                    bucket=self.influxdb_bucket,
-                    org=self.influxdb_org,
-                    record=point
-                )
-                
-                # Update statistics
-                with self._stats_lock:
-                    self.write_count += 1
-                    self.last_write_time = datetime.utcnow().isoformat() + 'Z'
-                
-                logger.info(f"Written to InfluxDB: {sensor_data['room']} - "
-                           f"Temp: {sensor_data['temperature']}°C, "
-                           f"Humidity: {sensor_data['humidity']}%")
-                
-                return  # Success, exit retry loop
-                
-            except Exception as e:
-                logger.error(f"Failed to write to InfluxDB (attempt {retry_count + 1}/{max_retries}): {e}")
-                with self._stats_lock:
-                    self.error_count += 1
-                
-                retry_count += 1
-                if retry_count < max_retries:
-                    wait_time = 2 ** retry_count  # Exponential backoff
-                    logger.info(f"Retrying write in {wait_time} seconds...")
-                    time.sleep(wait_time)
-                    
-                    # Try to reconnect on failure
-                    if retry_count == 2:  # On second failure, try to reconnect
-                        logger.info("Attempting to reconnect to InfluxDB...")
-                        self.connect_influxdb()
-        
-        logger.error(f"Failed to write to InfluxDB after {max_retries} attempts")
+                batch = [self._queue.get(timeout=1)]
+            except queue.Empty:
+                continue
+            
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            self.write_to_influxdb(batch)
+    
+    def write_to_influxdb(self, batch):
+        """Queue a batch of sensor readings for the batching InfluxDB writer"""
+        try:
+            # Encode straight to line protocol instead of building a Point per message
+            records = []
+            for sensor_data in batch:
+                try:
+                    records.append(encode_point(sensor_data))
+                except (AttributeError, KeyError, TypeError, ValueError) as e:
+                    logger.error(f"Skipping malformed sensor reading {sensor_data!r}: {e}")
+                    self.error_counter.inc()
+            
+            if not records:
+                return
+            
+            # Hand the whole batch over as one bytes record, which the batching writer passes through
+            # without re-encoding; it is flushed and retried in the background
+            self.write_api.write(
+                bucket=self.influxdb_bucket,
+                org=self.influxdb_org,
+                record=b'\n'.join(records),
+                write_precision=WritePrecision.NS
+            )
+            
+            logger.debug("Queued %d records for InfluxDB", len(records))
+            
+        except Exception as e:
+            logger.error(f"Failed to queue write to InfluxDB: {e}")
+            self.error_counter.inc()
+    
+    def on_write_success(self, conf, data):
+        """Callback for a batch successfully written to InfluxDB"""
+        points = data.count(b'\n' if isinstance(data, bytes) else '\n') + 1
+        self.write_counter.inc(points)
+        self.last_write_time = self.utc_timestamp()
+        logger.debug("Written batch of %d points to InfluxDB", points)
+    
+    def on_write_error(self, conf, data, exception):
+        """Callback for a batch that could not be written after all retries"""
+        logger.error(f"Failed to write batch to InfluxDB: {exception}")
+        self.error_counter.inc()
+    
+    def on_write_retry(self, conf, data, exception):
+        """Callback for a retryable InfluxDB write failure"""
+        logger.warning(f"Retrying InfluxDB batch write: {exception}")
     
     def connect_mqtt(self):
-        """Connect to MQTT broker with retry logic"""
-        max_retries = 5
-        retry_count = 0
-        
-        while retry_count < max_retries:
-            try:
-                logger.info(f"Attempting to connect to MQTT broker... (attempt {retry_count + 1}/{max_retries})")
-                self.mqtt_client.connect(self.mqtt_broker, self.mqtt_port, 60)
-                
-                # Wait for connection to establish
-                connection_timeout = 10
-                start_time = time.time()
-                while not self.mqtt_client.is_connected() and (time.time() - start_time) < connection_timeout:
-                    time.sleep(0.1)
-                
-                if self.mqtt_client.is_connected():
-                    return True
-                else:
-                    raise Exception("Connection timeout")
-                    
-            except Exception as e:
-                logger.error(f"MQTT connection attempt {retry_count + 1} failed: {e}")
-                with self._stats_lock:
-                    self.error_count += 1
-                
-                retry_count += 1
-                if retry_count < max_retries:
-                    wait_time = min(2 ** retry_count, 30)  # Exponential backoff, max 30 seconds
-                    logger.info(f"Waiting {wait_time} seconds before retry...")
-                    time.sleep(wait_time)
-        
-        logger.error(f"Failed to connect to MQTT broker after {max_retries} attempts")
-        return False
+        """Schedule the MQTT connection; the network loop connects and reconnects with backoff"""
+        self.mqtt_client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self.mqtt_client.connect_async(self.mqtt_broker, self.mqtt_port, 60)
     
     def run(self):
         """Main loop to run the subscriber"""
@@ -424,33 +684,133 @@ class SensorDataSubscriber:
             logger.error("Failed to connect to InfluxDB. Exiting.")
             return
         
+        # Start the writer before subscribing so no reading waits on an idle queue
+        self._writer_thread = threading.Thread(target=self.writer_loop, name='influxdb-writer')
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+        
         # Connect to MQTT
-        if not self.connect_mqtt():
-            logger.error("Failed to connect to MQTT broker. Exiting.")
-            return
+        self.connect_mqtt()
         
         logger.info("Starting data subscriber...")
-        logger.info(f"Subscribed to: smarthome/sensors/+")
+        logger.info(f"Subscribed to: {self.subscription}")
         logger.info(f"Writing to InfluxDB: {self.influxdb_url}")
         logger.info(f"Organization: {self.influxdb_org}, Bucket: {self.influxdb_bucket}")
         
         try:
-            # Start MQTT loop
-            self.mqtt_client.loop_forever()
+            # Run MQTT network I/O on paho's own thread, which keeps retrying until the broker accepts
+            # the first connection too. on_mqtt_message only enqueues, so slow InfluxDB writes can
+            # never hold up PINGREQs; the main thread just waits to be stopped
+            self.mqtt_client.loop_start()
+            self._stop_evt.wait()
             
         except KeyboardInterrupt:
             logger.info("Stopping data subscriber...")
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
-            with self._stats_lock:
-                self.error_count += 1
+            self.error_counter.inc()
         finally:
             self.running = False
             self.mqtt_client.disconnect()
+            self.mqtt_client.loop_stop()
+            if self._writer_thread:
+                # The writer exits once the queue is drained
+                self._writer_thread.join(timeout=WRITER_JOIN_TIMEOUT)
+            if self.write_api:
+                # Flush any points still waiting in the batch
+                self.write_api.close()
             if self.influx_client:
                 self.influx_client.close()
             self.stop_health_server()
             logger.info("Data subscriber stopped")
+    
+    def stop(self):
+        """Ask the main loop to exit; safe to call from a signal handler"""
+        self._stop_evt.set()
+
+def run_subscriber(**config):
+    """Create a subscriber and run it until it is interrupted or receives SIGTERM"""
+    subscriber = SensorDataSubscriber(**config)
+    
+    # Docker and Kubernetes stop containers with SIGTERM; shut down cleanly so the batch is flushed
+    def handle_sigterm(signum, frame):
+        logger.info("Received SIGTERM, stopping data subscriber...")
+        subscriber.stop()
+    
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    subscriber.run()
+
+def supervise_workers(workers, config):
+    """Run one subscriber process per worker, restarting any that crash with backoff, until SIGTERM"""
+    stop_evt = threading.Event()
+    
+    def handle_sigterm(signum, frame):
+        logger.info("Received SIGTERM, stopping subscriber workers...")
+        stop_evt.set()
+    
+    def start_worker(index):
+        # Each worker needs its own health port and, when one is configured, its own client id
+        worker_config = dict(config, health_port=config['health_port'] + index)
+        if config['client_id']:
+            worker_config['client_id'] = f"{config['client_id']}-{index}"
+        process = multiprocessing.Process(
+            target=run_subscriber, kwargs=worker_config, name=f'subscriber-{index}'
+        )
+        process.start()
+        logger.info(f"Started subscriber worker {index} (pid {process.pid}, health port {worker_config['health_port']})")
+        return process
+    
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    processes = [start_worker(index) for index in range(workers)]
+    started_at = [time.monotonic()] * workers
+    restart_delay = [WORKER_RESTART_DELAY_MIN] * workers
+    restart_at = [None] * workers
+    
+    try:
+        while not stop_evt.wait(1.0):
+            now = time.monotonic()
+            for index, process in enumerate(processes):
+                if process is None:
+                    continue
+                if restart_at[index] is not None:
+                    if now >= restart_at[index]:
+                        restart_at[index] = None
+                        processes[index] = start_worker(index)
+                        started_at[index] = now
+                    continue
+                if process.is_alive():
+                    continue
+                
+                if process.exitcode == 0:
+                    # A clean exit (e.g. InfluxDB could not be set up) would only repeat on restart
+                    logger.info(f"Subscriber worker {index} exited cleanly, not restarting")
+                    processes[index] = None
+                    continue
+                
+                # Back off on repeated crashes; a worker that stayed up for a while starts over
+                if now - started_at[index] >= WORKER_RESTART_DELAY_MAX:
+                    restart_delay[index] = WORKER_RESTART_DELAY_MIN
+                logger.error(
+                    f"Subscriber worker {index} exited with code {process.exitcode}, "
+                    f"restarting in {restart_delay[index]}s"
+                )
+                restart_at[index] = now + restart_delay[index]
+                restart_delay[index] = min(restart_delay[index] * 2, WORKER_RESTART_DELAY_MAX)
+            
+            if all(process is None for process in processes):
+                logger.warning("All subscriber workers have exited")
+                break
+    except KeyboardInterrupt:
+        logger.info("Stopping subscriber workers...")
+    finally:
+        # terminate() sends SIGTERM, so every worker flushes its pending batch before exiting
+        for process in processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in processes:
+            if process is not None:
+                process.join(timeout=15)
+        logger.info("Subscriber workers stopped")
 
 def main():
     # Get configuration from environment variables
@@ -461,26 +821,40 @@ def main():
     influxdb_org = os.getenv('INFLUXDB_ORG', 'smarthome')
     influxdb_bucket = os.getenv('INFLUXDB_BUCKET', 'sensor_data')
     health_port = int(os.getenv('HEALTH_PORT', '8080'))
+    shared_group = os.getenv('MQTT_SHARED_GROUP', 'smart-home-subscribers')
+    client_id = os.getenv('MQTT_CLIENT_ID', '')
+    workers = int(os.getenv('SUBSCRIBER_WORKERS', '1'))
+    qos = int(os.getenv('MQTT_QOS', '0'))
     
     logger.info("=== Smart Home Data Subscriber ===")
     logger.info(f"MQTT Broker: {mqtt_broker}:{mqtt_port}")
     logger.info(f"InfluxDB: {influxdb_url}")
     logger.info(f"Organization: {influxdb_org}, Bucket: {influxdb_bucket}")
     logger.info(f"Health Check Port: {health_port}")
+    logger.info(f"Shared Subscription Group: {shared_group or '(none)'}")
+    logger.info(f"Workers: {workers}")
+    logger.info(f"Subscription QoS: {qos}")
     
-    # Create and run subscriber
-    subscriber = SensorDataSubscriber(
+    config = dict(
         mqtt_broker=mqtt_broker,
         mqtt_port=mqtt_port,
         influxdb_url=influxdb_url,
         influxdb_token=influxdb_token,
         influxdb_org=influxdb_org,
         influxdb_bucket=influxdb_bucket,
-        health_port=health_port
+        health_port=health_port,
+        shared_group=shared_group,
+        client_id=client_id,
+        qos=qos
     )
     
-    subscriber.run()
+    if workers > 1:
+        # Several workers only split the load when they share a subscription group
+        if not shared_group:
+            logger.warning("SUBSCRIBER_WORKERS > 1 without MQTT_SHARED_GROUP; every worker will receive every message")
+        supervise_workers(workers, config)
+    else:
+        run_subscriber(**config)
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,60 @@
+"""
+Line protocol encoding for the Smart Home Data Subscriber
+Fully annotated and free of project imports, so it can be compiled with mypyc as-is
+"""
+from __future__ import annotations
+
+import calendar
+from datetime import datetime
+from typing import Any
+
+# Measurement prefix of every line protocol record written by the subscriber
+LINE_PREFIX = "sensor_data,"
+
+# Tag values must have commas, equals signs and spaces backslash-escaped in line protocol
+TAG_ESCAPES = str.maketrans({',': r'\,', '=': r'\=', ' ': r'\ '})
+
+# Record layout for a full reading, formatted in one step; partial readings take the general path
+LINE_FORMAT = LINE_PREFIX + "device_id=%s,room=%s temperature=%r,humidity=%r,battery_level=%di %d"
+
+def timestamp_to_ns(timestamp: str) -> int:
+    """Convert an ISO-8601 timestamp (naive values are taken as UTC) to epoch nanoseconds"""
+    dt = datetime.fromisoformat(timestamp)
+    return (calendar.timegm(dt.utctimetuple()) * 1_000_000 + dt.microsecond) * 1000
+
+def escape_tag(value: object) -> str:
+    """Escape a tag value for line protocol; most values need no escaping, so check before translating"""
+    tag = str(value)
+    if ',' in tag or '=' in tag or ' ' in tag:
+        return tag.translate(TAG_ESCAPES)
+    return tag
+
+def encode_point(sensor_data: dict[str, Any]) -> bytes:
+    """Encode one sensor reading as an InfluxDB line protocol record"""
+    # Publishers send epoch nanoseconds alongside the ISO string; parse the string only as a fallback
+    raw_timestamp_ns = sensor_data.get('timestamp_ns')
+    if raw_timestamp_ns is None:
+        timestamp_ns = timestamp_to_ns(str(sensor_data['timestamp']))
+    else:
+        timestamp_ns = int(raw_timestamp_ns)
+    
+    if 'device_id' in sensor_data and 'battery_level' in sensor_data:
+        return (LINE_FORMAT % (
+            escape_tag(sensor_data['device_id']),
+            escape_tag(sensor_data['room']),
+            float(sensor_data['temperature']),
+            float(sensor_data['humidity']),
+            int(sensor_data['battery_level']),
+            timestamp_ns
+        )).encode()
+    
+    tags = 'room=' + escape_tag(sensor_data['room'])
+    if 'device_id' in sensor_data:
+        tags = 'device_id=' + escape_tag(sensor_data['device_id']) + ',' + tags
+    
+    fields = (f"temperature={float(sensor_data['temperature'])!r},"
+              f"humidity={float(sensor_data['humidity'])!r}")
+    if 'battery_level' in sensor_data:
+        fields += f",battery_level={int(sensor_data['battery_level'])}i"
+    
+    return f"{LINE_PREFIX}{tags} {fields} {timestamp_ns}".encode()